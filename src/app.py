@@ -1,20 +1,90 @@
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, request, render_template, Response
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 from PIL import Image
-import tempfile
 import base64
+import io
+import hashlib
+import threading
+from concurrent import futures
+from enum import IntEnum
+from itertools import chain, islice
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from flask_compress import Compress
 
 load_dotenv()
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 
+# Compress JSON responses large enough to benefit
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+Compress(app)
+
 # API Keys
 SERPAPI_KEY = os.getenv('SERPAPI_KEY')
 TOOLHOUSE_API_KEY = os.getenv('TOOLHOUSE_API_KEY')  # Add this to your .env file
 TOOLHOUSE_BASE_URL = "https://api.toolhouse.ai/v1"
 
+# Sources without a key are skipped at the route level
+HAS_SERPAPI = bool(SERPAPI_KEY)
+HAS_TOOLHOUSE = bool(TOOLHOUSE_API_KEY)
+
+# Search sources, in the order their results are combined
+SEARCH_SOURCES = ('serpapi', 'toolhouse')
+
+# Request threads per process; the Procfile passes the same value to gunicorn --threads
+WEB_THREADS = int(os.getenv('WEB_THREADS', '16'))
+
+# Shared pool for outbound searches, reused across requests. Every request thread
+# can run all sources at once, so searches never queue behind other requests.
+EXECUTOR = futures.ThreadPoolExecutor(max_workers=WEB_THREADS * len(SEARCH_SOURCES))
+SEARCH_TIMEOUT = 20  # seconds to wait for all search sources
+REQUEST_TIMEOUT = (3, 12)  # (connect, read) for each outbound call attempt
+CONNECT_RETRIES = 1  # worst case: (1 + CONNECT_RETRIES) * connect + backoff + read < SEARCH_TIMEOUT
+MAX_BULK_IMAGES = 10  # images per /bulk-check-plagiarism request
+
+# Bulk checks run one at a time per process on a pool with a thread per search
+BULK_EXECUTOR = futures.ThreadPoolExecutor(max_workers=MAX_BULK_IMAGES * len(SEARCH_SOURCES))
+BULK_LOCK = threading.Lock()
+
+
+class Similarity(IntEnum):
+    """How closely a match resembles the upload; lower values sort first"""
+    HIGH = 0
+    MEDIUM = 1
+    LOW = 2
+
+    @property
+    def label(self):
+        return self.name.title()
+
+
+# Similarity labels returned by Toolhouse; anything else sorts as Low and the
+# raw value is kept in the match's similarity_score
+SIMILARITY_LABELS = {'High': Similarity.HIGH, 'Medium': Similarity.MEDIUM}
+
+# Shared HTTP session so outbound calls reuse keep-alive connections
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=20,
+                                      max_retries=Retry(total=CONNECT_RETRIES,
+                                                        connect=CONNECT_RETRIES,
+                                                        backoff_factor=0.2)))
+
+# Per-source results keyed by (SHA-256 of the uploaded bytes, source)
+RESULTS_CACHE = TTLCache(maxsize=1024, ttl=3600)
+RESULTS_CACHE_LOCK = threading.Lock()
+
+
+def ojsonify(obj):
+    """Serialize obj to a JSON response with orjson"""
+    return Response(orjson.dumps(obj), mimetype='application/json')
+
 
 @app.route('/')
 def index():
@@ -24,49 +94,191 @@ def index():
 @app.route('/check-plagiarism', methods=['POST'])
 def check_plagiarism():
     if 'image' not in request.files:
-        return jsonify({'error': 'No image uploaded'}), 400
+        return ojsonify({'error': 'No image uploaded'}), 400
 
     file = request.files['image']
     if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+        return ojsonify({'error': 'No file selected'}), 400
 
-    # Save temporarily
-    temp_path = os.path.join('uploads', file.filename)
-    file.save(temp_path)
+    # Read the upload once and keep it in memory
+    image_bytes = file.read()
+
+    img_info = get_image_info(image_bytes, file.filename)
+    if img_info is None:
+        return ojsonify({'error': 'Invalid image file'}), 400
+
+    # Reuse each source's results for an identical upload; search the rest
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    cached = get_cached_results(image_hash)
+
+    search_futures = submit_searches(image_bytes, file.filename, cached)
+    done = wait_for_searches(search_futures.values())
+    source_results = collect_search_results(search_futures, done)
+    cache_results(image_hash, source_results)
+
+    return ojsonify({
+        'image_info': img_info,
+        'results': combine_source_results({**cached, **source_results}),
+        'sources_used': get_sources_used()
+    })
+
+
+@app.route('/bulk-check-plagiarism', methods=['POST'])
+def bulk_check_plagiarism():
+    files = [file for file in request.files.getlist('images') if file.filename != '']
+    if not files:
+        return ojsonify({'error': 'No images uploaded'}), 400
+
+    if len(files) > MAX_BULK_IMAGES:
+        return ojsonify({'error': f'At most {MAX_BULK_IMAGES} images per request'}), 400
+
+    # Read every upload; identical uploads in one batch share a single search
+    images = []
+    searches = {}
+    for file in files:
+        image_bytes = file.read()
+        img_info = get_image_info(image_bytes, file.filename)
+        if img_info is None:
+            images.append({'filename': file.filename, 'error': 'Invalid image file'})
+            continue
+
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        searches.setdefault(image_hash, (image_bytes, file.filename))
+        images.append({'image_info': img_info, 'hash': image_hash})
+
+    # One batch at a time on its own pool, sized so a batch never queues
+    # and never takes threads from /check-plagiarism
+    if not BULK_LOCK.acquire(timeout=SEARCH_TIMEOUT):
+        return ojsonify({'error': 'Another bulk check is in progress'}), 503
 
-    # Get image info
     try:
-        img = Image.open(temp_path)
-        img_info = {
-            'size': img.size,
-            'format': img.format,
-            'filename': file.filename
+        cached = {image_hash: get_cached_results(image_hash) for image_hash in searches}
+        search_futures = {
+            image_hash: submit_searches(image_bytes, filename, cached[image_hash], BULK_EXECUTOR)
+            for image_hash, (image_bytes, filename) in searches.items()
         }
-    except Exception as e:
-        return jsonify({'error': 'Invalid image file'}), 400
+        done = wait_for_searches([
+            future for image_futures in search_futures.values() for future in image_futures.values()
+        ])
+    finally:
+        BULK_LOCK.release()
+
+    combined = {}
+    for image_hash, image_futures in search_futures.items():
+        source_results = collect_search_results(image_futures, done)
+        cache_results(image_hash, source_results)
+        combined[image_hash] = combine_source_results({**cached[image_hash], **source_results})
+
+    results = []
+    for image in images:
+        if 'error' in image:
+            results.append(image)
+        else:
+            results.append({'image_info': image['image_info'], 'results': combined[image['hash']]})
 
-    # Search for similar images using multiple methods
-    serpapi_results = search_similar_images_serpapi(temp_path)
-    toolhouse_results = search_similar_images_toolhouse(temp_path)
+    return ojsonify({
+        'images': results,
+        'sources_used': get_sources_used()
+    })
 
-    # Combine results
-    combined_results = combine_search_results(serpapi_results, toolhouse_results)
 
-    # Clean up
-    os.remove(temp_path)
+def get_image_info(image_bytes, filename):
+    """Read basic image info, or None if the bytes are not an image"""
 
-    return jsonify({
-        'image_info': img_info,
-        'results': combined_results,
-        'sources_used': ['SerpAPI', 'Toolhouse']
-    })
+    # Image.open only parses the header; pixel data is never decoded here
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            return {
+                'size': img.size,
+                'format': img.format,
+                'filename': filename
+            }
+    except Exception:
+        return None
+
+
+def get_cached_results(image_hash):
+    """Get the cached results of each source that already searched this upload"""
+
+    cached = {}
+    with RESULTS_CACHE_LOCK:
+        for source in SEARCH_SOURCES:
+            results = RESULTS_CACHE.get((image_hash, source))
+            if results is not None:
+                cached[source] = results
+    return cached
 
 
-def search_similar_images_serpapi(image_path):
-    """Use SerpApi to search for similar images"""
+def cache_results(image_hash, source_results):
+    """Cache each source's results, skipping failed ones so they are retried"""
 
-    if not SERPAPI_KEY:
-        return {'matches': [], 'total_found': 0, 'source': 'serpapi'}
+    with RESULTS_CACHE_LOCK:
+        for source, results in source_results.items():
+            if not results.get('error'):
+                RESULTS_CACHE[(image_hash, source)] = results
+
+
+def get_sources_used():
+    """Names of the sources that have an API key configured"""
+
+    sources = []
+    if HAS_SERPAPI:
+        sources.append('SerpAPI')
+    if HAS_TOOLHOUSE:
+        sources.append('Toolhouse')
+    return sources
+
+
+def submit_searches(image_bytes, filename, cached, executor=EXECUTOR):
+    """Start a search on the executor for each configured, uncached source"""
+
+    search_futures = {}
+    if HAS_SERPAPI and 'serpapi' not in cached:
+        search_futures['serpapi'] = executor.submit(
+            search_similar_images_serpapi, image_bytes, filename)
+    if HAS_TOOLHOUSE and 'toolhouse' not in cached:
+        search_futures['toolhouse'] = executor.submit(
+            search_similar_images_toolhouse, image_bytes)
+    return search_futures
+
+
+def wait_for_searches(search_futures):
+    """Wait for searches up to SEARCH_TIMEOUT and return the finished ones"""
+
+    done, not_done = futures.wait(search_futures, timeout=SEARCH_TIMEOUT)
+
+    # Drop searches still queued behind others; running ones are bounded by REQUEST_TIMEOUT
+    for future in not_done:
+        future.cancel()
+
+    return done
+
+
+def collect_search_results(search_futures, done):
+    """Get the results of one image's searches, keyed by source"""
+
+    return {
+        source: collect_search_result(future, done, source)
+        for source, future in search_futures.items()
+    }
+
+
+def collect_search_result(future, done, source):
+    """Get a search result from a future, or an error result if it is not done"""
+
+    if future not in done:
+        return {
+            'matches': [],
+            'total_found': 0,
+            'error': f'{source} search timed out',
+            'source': source
+        }
+
+    return future.result()
+
+
+def search_similar_images_serpapi(image_bytes, filename):
+    """Use SerpApi to search for similar images; callers must check HAS_SERPAPI first"""
 
     try:
         params = {
@@ -75,49 +287,49 @@ def search_similar_images_serpapi(image_path):
         }
 
         files = {
-            'image_file': open(image_path, 'rb')
+            'image_file': (filename, image_bytes)
         }
 
-        response = requests.post('https://serpapi.com/search', data=params, files=files)
-        data = response.json()
+        response = SESSION.post('https://serpapi.com/search', data=params, files=files,
+                                timeout=REQUEST_TIMEOUT)
+        data = orjson.loads(response.content)
 
-        matches = []
-        if 'image_results' in data:
-            for result in data['image_results'][:5]:
-                matches.append({
+        # Keyed by link so duplicate pages are dropped as they are added
+        matches = {}
+        for result in islice(data.get('image_results', ()), 5):
+            link = result.get('link', '')
+            if link:
+                matches.setdefault(link, {
                     'title': result.get('title', 'No title'),
                     'source': result.get('source', 'Unknown source'),
                     'thumbnail': result.get('thumbnail', ''),
-                    'link': result.get('link', ''),
-                    'similarity': 'High',
+                    'link': link,
+                    'similarity': Similarity.HIGH,
                     'search_engine': 'Google (SerpAPI)'
                 })
 
         return {
-            'matches': matches,
+            'matches': list(matches.values()),
             'total_found': len(matches),
             'source': 'serpapi'
         }
 
-    except Exception as e:
+    except Exception:
+        app.logger.exception('SerpAPI search failed')
         return {
             'matches': [],
             'total_found': 0,
-            'error': str(e),
+            'error': 'serpapi search failed',
             'source': 'serpapi'
         }
 
 
-def search_similar_images_toolhouse(image_path):
-    """Use Toolhouse to crawl and scrape for similar images"""
-
-    if not TOOLHOUSE_API_KEY:
-        return {'matches': [], 'total_found': 0, 'source': 'toolhouse'}
+def search_similar_images_toolhouse(image_bytes):
+    """Use Toolhouse to crawl and scrape for similar images; callers must check HAS_TOOLHOUSE first"""
 
     try:
-        # Convert image to base64 for Toolhouse API
-        with open(image_path, 'rb') as img_file:
-            image_base64 = base64.b64encode(img_file.read()).decode('utf-8')
+        # Encode on the worker thread, once, shared with the site crawl
+        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
 
         # Toolhouse API request for web scraping
         headers = {
@@ -129,11 +341,10 @@ def search_similar_images_toolhouse(image_path):
         # Use Toolhouse's web scraping tools to find similar images
         payload = {
            # Configure API Here
-            }
         }
 
-        # response = requests.post(f'{TOOLHOUSE_BASE_URL}/tools/execute', <- Does Not Make Sense
-                                # json=payload, headers=headers)
+        # response = SESSION.post(f'{TOOLHOUSE_BASE_URL}/tools/execute', <- Does Not Make Sense
+                                # json=payload, headers=headers, timeout=REQUEST_TIMEOUT)
 
         if response.status_code != 200:
             return {
@@ -143,81 +354,88 @@ def search_similar_images_toolhouse(image_path):
                 'source': 'toolhouse'
             }
 
-        data = response.json()
-        matches = []
+        data = orjson.loads(response.content)
+
+        # Keyed by link so crawl results that repeat a match are dropped
+        matches = {}
 
         # Process Toolhouse results
-        if 'results' in data and 'matches' in data['results']:
-            for result in data['results']['matches'][:5]:
-                matches.append({
+        for result in islice(data.get('results', {}).get('matches', ()), 5):
+            link = result.get('page_url', '')
+            if link:
+                matches.setdefault(link, {
                     'title': result.get('title', 'No title'),
                     'source': result.get('domain', 'Unknown source'),
                     'thumbnail': result.get('thumbnail_url', ''),
-                    'link': result.get('page_url', ''),
-                    'similarity': result.get('similarity_score', 'Medium'),
+                    'link': link,
+                    'similarity': SIMILARITY_LABELS.get(result.get('similarity_score', 'Medium'),
+                                                        Similarity.LOW),
+                    'similarity_score': result.get('similarity_score'),
                     'search_engine': result.get('found_via', 'Toolhouse Scraper'),
                     'additional_info': result.get('metadata', {})
                 })
 
         # Use Toolhouse to crawl specific sites for more matches
-        additional_matches = crawl_image_sites_toolhouse(image_base64)
-        matches.extend(additional_matches)
+        for match in crawl_image_sites_toolhouse(image_base64):
+            if match.get('link'):
+                matches.setdefault(match['link'], match)
 
         return {
-            'matches': matches,
+            'matches': list(matches.values()),
             'total_found': len(matches),
             'source': 'toolhouse'
         }
 
-    except Exception as e:
+    except Exception:
+        app.logger.exception('Toolhouse search failed')
         return {
             'matches': [],
             'total_found': 0,
-            'error': str(e),
+            'error': 'toolhouse search failed',
             'source': 'toolhouse'
         }
 
+def combine_source_results(source_results):
+    """Combine per-source results; a source that was not searched counts as empty"""
+
+    return combine_search_results(
+        source_results.get('serpapi', {'matches': [], 'total_found': 0, 'source': 'serpapi'}),
+        source_results.get('toolhouse', {'matches': [], 'total_found': 0, 'source': 'toolhouse'})
+    )
+
+
 def combine_search_results(serpapi_results, toolhouse_results):
     """Combine and deduplicate results from different sources"""
 
-    all_matches = []
+    # High, Medium, then everything else; bucketing keeps source order within each
+    buckets = ([], [], [])
     seen_urls = set()
 
-    # Add SerpAPI results
-    for match in serpapi_results.get('matches', []):
+    for match in chain(serpapi_results.get('matches', []), toolhouse_results.get('matches', [])):
         url = match.get('link', '')
         if url and url not in seen_urls:
             seen_urls.add(url)
-            all_matches.append(match)
-
-    # Add Toolhouse results
-    for match in toolhouse_results.get('matches', []):
-        url = match.get('link', '')
-        if url and url not in seen_urls:
-            seen_urls.add(url)
-            all_matches.append(match)
-
-    # Sort by similarity or search engine preference
-    def sort_key(match):
-        similarity = match.get('similarity', 'Low')
-        if similarity == 'High':
-            return 0
-        elif similarity == 'Medium':
-            return 1
-        else:
-            return 2
+            buckets[match.get('similarity', Similarity.LOW)].append(match)
 
-    all_matches.sort(key=sort_key)
+    # Similarity is rendered as its label in the response
+    all_matches = [
+        dict(match, similarity=match.get('similarity', Similarity.LOW).label)
+        for match in chain(*buckets)
+    ]
 
     return {
         'matches': all_matches,
         'total_found': len(all_matches),
         'serpapi_count': serpapi_results.get('total_found', 0),
         'toolhouse_count': toolhouse_results.get('total_found', 0),
-        'errors': []
+        'errors': [
+            results['error']
+            for results in (serpapi_results, toolhouse_results)
+            if results.get('error')
+        ]
     }
 
 
 if __name__ == '__main__':
-    os.makedirs('uploads', exist_ok=True)
-    app.run(debug=True)
\ No newline at end of file
+    # Development server only; see the Procfile for running under gunicorn
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1')
\ No newline at end of file
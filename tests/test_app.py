@@ -0,0 +1,386 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import app as app_module
+from app import Similarity
+
+
+def make_png():
+    buf = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buf, 'PNG')
+    buf.seek(0)
+    return buf
+
+
+def empty_result(source):
+    return {'matches': [], 'total_found': 0, 'source': source}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    app_module.RESULTS_CACHE.clear()
+    monkeypatch.setattr(app_module, 'HAS_SERPAPI', True)
+    monkeypatch.setattr(app_module, 'HAS_TOOLHOUSE', True)
+    return app_module.app.test_client()
+
+
+def test_searches_run_in_parallel(client, monkeypatch):
+    def slow_serpapi(image_bytes, filename):
+        time.sleep(0.5)
+        return empty_result('serpapi')
+
+    def slow_toolhouse(image_bytes):
+        time.sleep(0.5)
+        return empty_result('toolhouse')
+
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi', slow_serpapi)
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse', slow_toolhouse)
+
+    start = time.monotonic()
+    response = client.post('/check-plagiarism', data={'image': (make_png(), 'a.png')})
+    elapsed = time.monotonic() - start
+
+    assert response.status_code == 200
+    assert elapsed < 0.9
+    assert response.get_json()['results']['errors'] == []
+
+
+def test_slow_search_reports_timeout(client, monkeypatch):
+    release = threading.Event()
+
+    def stuck_toolhouse(image_bytes):
+        release.wait(5)
+        return empty_result('toolhouse')
+
+    monkeypatch.setattr(app_module, 'SEARCH_TIMEOUT', 0.5)
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi',
+                        lambda image_bytes, filename: empty_result('serpapi'))
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse', stuck_toolhouse)
+
+    try:
+        start = time.monotonic()
+        response = client.post('/check-plagiarism', data={'image': (make_png(), 'a.png')})
+        elapsed = time.monotonic() - start
+    finally:
+        release.set()
+
+    assert response.status_code == 200
+    assert elapsed < 1.5
+    assert response.get_json()['results']['errors'] == ['toolhouse search timed out']
+
+
+def test_upload_is_read_once_and_shared(client, monkeypatch):
+    calls = {}
+
+    def fake_serpapi(image_bytes, filename):
+        calls['serpapi'] = (image_bytes, filename)
+        return empty_result('serpapi')
+
+    def fake_toolhouse(image_bytes):
+        calls['toolhouse'] = image_bytes
+        return empty_result('toolhouse')
+
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi', fake_serpapi)
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse', fake_toolhouse)
+
+    png = make_png().getvalue()
+    response = client.post('/check-plagiarism', data={'image': (io.BytesIO(png), 'a.png')})
+
+    assert response.status_code == 200
+    assert calls['serpapi'] == (png, 'a.png')
+    assert calls['toolhouse'] == png
+
+
+def test_identical_upload_is_served_from_cache(client, monkeypatch):
+    calls = []
+
+    def fake_serpapi(image_bytes, filename):
+        calls.append(filename)
+        return empty_result('serpapi')
+
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi', fake_serpapi)
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse',
+                        lambda image_bytes: empty_result('toolhouse'))
+
+    png = make_png().getvalue()
+    first = client.post('/check-plagiarism', data={'image': (io.BytesIO(png), 'a.png')})
+    second = client.post('/check-plagiarism', data={'image': (io.BytesIO(png), 'b.png')})
+
+    assert calls == ['a.png']
+    assert first.get_json()['results'] == second.get_json()['results']
+    assert second.get_json()['image_info']['filename'] == 'b.png'
+
+
+def test_results_with_errors_are_not_cached(client, monkeypatch):
+    calls = []
+
+    def failing_serpapi(image_bytes, filename):
+        calls.append(filename)
+        return dict(empty_result('serpapi'), error='boom')
+
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi', failing_serpapi)
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse',
+                        lambda image_bytes: empty_result('toolhouse'))
+
+    png = make_png().getvalue()
+    client.post('/check-plagiarism', data={'image': (io.BytesIO(png), 'a.png')})
+    client.post('/check-plagiarism', data={'image': (io.BytesIO(png), 'a.png')})
+
+    assert len(calls) == 2
+
+
+def test_combine_dedupes_and_orders_by_similarity():
+    serpapi = {'matches': [
+        {'link': 'a', 'similarity': Similarity.LOW},
+        {'link': 'b', 'similarity': Similarity.HIGH},
+        {'link': '', 'similarity': Similarity.HIGH},
+    ], 'total_found': 3}
+    toolhouse = {'matches': [
+        {'link': 'b', 'similarity': Similarity.MEDIUM},
+        {'link': 'c', 'similarity': Similarity.MEDIUM},
+        {'link': 'd', 'similarity': Similarity.HIGH},
+    ], 'total_found': 3}
+
+    combined = app_module.combine_search_results(serpapi, toolhouse)
+
+    assert [m['link'] for m in combined['matches']] == ['b', 'd', 'c', 'a']
+    assert combined['matches'][0]['similarity'] == 'High'
+    assert combined['total_found'] == 4
+
+
+def test_bulk_check_searches_each_image(client, monkeypatch):
+    calls = []
+
+    def fake_serpapi(image_bytes, filename):
+        calls.append(filename)
+        return {'matches': [{'link': filename, 'similarity': Similarity.HIGH}], 'total_found': 1}
+
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi', fake_serpapi)
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse',
+                        lambda image_bytes: empty_result('toolhouse'))
+
+    red = io.BytesIO()
+    Image.new('RGB', (8, 8), 'red').save(red, 'PNG')
+    red.seek(0)
+    response = client.post('/bulk-check-plagiarism', data={'images': [
+        (make_png(), 'a.png'),
+        (io.BytesIO(b'not an image'), 'b.txt'),
+        (red, 'c.png'),
+    ]})
+
+    images = response.get_json()['images']
+    assert response.status_code == 200
+    assert sorted(calls) == ['a.png', 'c.png']
+    assert images[0]['results']['matches'][0]['link'] == 'a.png'
+    assert images[1] == {'filename': 'b.txt', 'error': 'Invalid image file'}
+    assert images[2]['image_info']['filename'] == 'c.png'
+
+
+def test_bulk_check_requires_images(client):
+    response = client.post('/bulk-check-plagiarism', data={})
+
+    assert response.status_code == 400
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.content = json.dumps(data).encode()
+
+
+def test_serpapi_drops_duplicate_links(monkeypatch):
+    data = {'image_results': [
+        {'title': 'first', 'link': 'https://a.example'},
+        {'title': 'again', 'link': 'https://a.example'},
+        {'title': 'no link'},
+        {'title': 'other', 'link': 'https://b.example'},
+    ]}
+    monkeypatch.setattr(app_module.SESSION, 'post', lambda *args, **kwargs: FakeResponse(data))
+
+    results = app_module.search_similar_images_serpapi(b'image', 'a.png')
+
+    assert [m['title'] for m in results['matches']] == ['first', 'other']
+    assert results['matches'][0]['similarity'] is Similarity.HIGH
+    assert results['total_found'] == 2
+
+
+def test_image_info_reads_header_only():
+    # Truncated pixel data still yields size and format, so nothing was decoded
+    png = make_png().getvalue()[:41]
+
+    assert app_module.get_image_info(png, 'a.png') == {
+        'size': (8, 8),
+        'format': 'PNG',
+        'filename': 'a.png'
+    }
+    assert app_module.get_image_info(b'not an image', 'b.txt') is None
+
+
+def test_large_json_responses_are_compressed(client, monkeypatch):
+    matches = [
+        {'link': f'https://example.com/{i}', 'similarity': Similarity.HIGH}
+        for i in range(100)
+    ]
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi',
+                        lambda image_bytes, filename: {'matches': matches, 'total_found': 100})
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse',
+                        lambda image_bytes: empty_result('toolhouse'))
+
+    response = client.post('/check-plagiarism', data={'image': (make_png(), 'a.png')},
+                           headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_unconfigured_source_is_not_searched(client, monkeypatch):
+    def unexpected_toolhouse(image_bytes):
+        raise AssertionError('Toolhouse should not be searched without a key')
+
+    monkeypatch.setattr(app_module, 'HAS_TOOLHOUSE', False)
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi',
+                        lambda image_bytes, filename: empty_result('serpapi'))
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse', unexpected_toolhouse)
+
+    response = client.post('/check-plagiarism', data={'image': (make_png(), 'a.png')})
+
+    assert response.get_json()['sources_used'] == ['SerpAPI']
+    assert response.get_json()['results']['errors'] == []
+
+
+def test_sources_are_cached_independently(client, monkeypatch):
+    calls = []
+
+    def fake_serpapi(image_bytes, filename):
+        calls.append('serpapi')
+        return empty_result('serpapi')
+
+    def failing_toolhouse(image_bytes):
+        calls.append('toolhouse')
+        return dict(empty_result('toolhouse'), error='toolhouse search failed')
+
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi', fake_serpapi)
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse', failing_toolhouse)
+
+    png = make_png().getvalue()
+    client.post('/check-plagiarism', data={'image': (io.BytesIO(png), 'a.png')})
+    response = client.post('/check-plagiarism', data={'image': (io.BytesIO(png), 'a.png')})
+
+    assert calls == ['serpapi', 'toolhouse', 'toolhouse']
+    assert response.get_json()['results']['errors'] == ['toolhouse search failed']
+
+
+def test_search_errors_do_not_leak_exception_text(monkeypatch):
+    def broken_post(*args, **kwargs):
+        raise RuntimeError('secret internal detail')
+
+    monkeypatch.setattr(app_module.SESSION, 'post', broken_post)
+
+    results = app_module.search_similar_images_serpapi(b'image', 'a.png')
+
+    assert results['error'] == 'serpapi search failed'
+
+
+def test_serpapi_call_uses_request_timeout(monkeypatch):
+    seen = {}
+
+    def fake_post(*args, **kwargs):
+        seen.update(kwargs)
+        return FakeResponse({})
+
+    monkeypatch.setattr(app_module.SESSION, 'post', fake_post)
+
+    app_module.search_similar_images_serpapi(b'image', 'a.png')
+
+    assert seen['timeout'] == app_module.REQUEST_TIMEOUT
+
+
+def test_worst_case_request_fits_in_search_timeout():
+    retries = app_module.SESSION.get_adapter('https://serpapi.com').max_retries
+    connect, read = app_module.REQUEST_TIMEOUT
+    backoff = sum(retries.backoff_factor * 2 ** n for n in range(retries.connect))
+
+    assert retries.total <= retries.connect
+    assert (1 + retries.connect) * connect + backoff + read < app_module.SEARCH_TIMEOUT
+
+
+def make_distinct_pngs(count):
+    pngs = []
+    for i in range(count):
+        buf = io.BytesIO()
+        Image.new('RGB', (8, 8), (i, 0, 0)).save(buf, 'PNG')
+        pngs.append(buf.getvalue())
+    return pngs
+
+
+def test_bulk_check_does_not_queue_searches(client, monkeypatch):
+    def slow_serpapi(image_bytes, filename):
+        time.sleep(0.4)
+        return empty_result('serpapi')
+
+    def slow_toolhouse(image_bytes):
+        time.sleep(0.4)
+        return empty_result('toolhouse')
+
+    monkeypatch.setattr(app_module, 'SEARCH_TIMEOUT', 1)
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi', slow_serpapi)
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse', slow_toolhouse)
+
+    pngs = make_distinct_pngs(app_module.MAX_BULK_IMAGES)
+    response = client.post('/bulk-check-plagiarism', data={'images': [
+        (io.BytesIO(png), f'{i}.png') for i, png in enumerate(pngs)
+    ]})
+
+    images = response.get_json()['images']
+    assert len(images) == app_module.MAX_BULK_IMAGES
+    assert all(image['results']['errors'] == [] for image in images)
+
+
+def test_bulk_check_searches_identical_uploads_once(client, monkeypatch):
+    calls = []
+
+    def fake_serpapi(image_bytes, filename):
+        calls.append(filename)
+        return empty_result('serpapi')
+
+    monkeypatch.setattr(app_module, 'search_similar_images_serpapi', fake_serpapi)
+    monkeypatch.setattr(app_module, 'search_similar_images_toolhouse',
+                        lambda image_bytes: empty_result('toolhouse'))
+
+    png = make_png().getvalue()
+    response = client.post('/bulk-check-plagiarism', data={'images': [
+        (io.BytesIO(png), 'a.png'),
+        (io.BytesIO(png), 'b.png'),
+    ]})
+
+    images = response.get_json()['images']
+    assert calls == ['a.png']
+    assert [image['image_info']['filename'] for image in images] == ['a.png', 'b.png']
+
+
+def test_combine_treats_missing_similarity_as_low():
+    serpapi = {'matches': [{'link': 'a'}], 'total_found': 1}
+    toolhouse = {'matches': [{'link': 'b', 'similarity': Similarity.HIGH}], 'total_found': 1}
+
+    combined = app_module.combine_search_results(serpapi, toolhouse)
+
+    assert [(m['link'], m['similarity']) for m in combined['matches']] == [
+        ('b', 'High'), ('a', 'Low')
+    ]
+
+
+
+def test_combine_keeps_raw_similarity_score():
+    toolhouse = {'matches': [
+        {'link': 'a', 'similarity': Similarity.LOW, 'similarity_score': 0.93},
+    ], 'total_found': 1}
+
+    combined = app_module.combine_search_results({'matches': []}, toolhouse)
+
+    assert combined['matches'][0]['similarity'] == 'Low'
+    assert combined['matches'][0]['similarity_score'] == 0.93